@@ -1,8 +1,12 @@
+import csv
 import numpy as np
-import copy
-import pandas as pd
 import pprint
 
+try:
+    from numba import njit
+except ImportError:  # numba is optional, the NumPy sweeps are used without it
+    njit = None
+
 
 
 TILE_REWARD = {
@@ -11,6 +15,9 @@ TILE_REWARD = {
     "Green": 1,
     }
 
+TILE_ID = {"White": 0, "Brown": 1, "Green": 2, "Wall": 3}
+WALL_ID = TILE_ID["Wall"]
+
 ACTIONS = {
     "UP": 0,
     "DOWN": 1,
@@ -18,10 +25,69 @@ ACTIONS = {
     "RIGHT": 3
     }
 
+# intended action first (p=0.8), then the two perpendicular slips (p=0.1 each)
+ACTION_OUTCOMES = np.array([[0, 2, 3], [1, 2, 3], [2, 0, 1], [3, 0, 1]], dtype=np.int8)
+ACTION_PROBS = np.array([0.8, 0.1, 0.1])
+
+
+def numpy_evaluate(R_next, next_idx, probs, V, gamma):
+    V_new = (probs * (R_next + gamma * V[next_idx])).sum(-1)  # we can put r inside as p sums to 1 anyway
+    return V_new, np.abs(V_new - V).max()
+
+
+def loop_evaluate(R_next, next_idx, probs, V, gamma):
+    # Gauss-Seidel: V is updated in place, which saves the V_new buffer
+    n_states, n_outcomes = next_idx.shape
+    delta = 0.0
+    for s in range(n_states):
+        value = 0.0
+        for k in range(n_outcomes):
+            value += probs[k] * (R_next[s, k] + gamma * V[next_idx[s, k]])
+        delta = max(delta, abs(value - V[s]))
+        V[s] = value
+    return V, delta
+
+
+def loop_improve(next_idx, probs, V, policy, gamma):
+    n_states, n_actions, n_outcomes = next_idx.shape
+    new_policy = policy.copy()
+    is_stable = True
+    for s in range(n_states):
+        argmax_action = 0
+        max_a_value = 0.0  # seeded by the first action, a fixed floor like -1 skips states whose values are lower
+
+        for a in range(n_actions):
+            a_value = 0.0
+            for k in range(n_outcomes):
+                a_value += probs[k] * (gamma * V[next_idx[s, a, k]])
+
+            if a == 0 or a_value > max_a_value:
+                max_a_value = a_value
+                argmax_action = a
+                new_policy[s] = argmax_action
+
+        if policy[s] != argmax_action:
+            is_stable = False
+
+    return new_policy, is_stable
+
+
+# Numba runs policy evaluation Gauss-Seidel, the NumPy fallback Jacobi since an in-place update cannot be
+# vectorized. Both converge, but the final values and recorded history differ slightly between the
+# two, so results depend on whether Numba is installed (up to 0.0014 on the default map with float64)
+if njit is not None:
+    evaluate_sweep = njit(cache=True, fastmath=True)(loop_evaluate)
+    improve_sweep = njit(cache=True, fastmath=True)(loop_improve)
+else:
+    evaluate_sweep = numpy_evaluate
+    improve_sweep = loop_improve
+
+
 class GridWorld:
 
-    def __init__(self, tile_reward= TILE_REWARD, map = None, size = None):
+    def __init__(self, tile_reward= TILE_REWARD, map = None, dtype = np.float32):
         self.tile_reward = tile_reward
+        self.dtype = dtype  # float32 is plenty for these grids, pass np.float64 for full precision
         if map == None:
             self.map = [["Green", "Wall", "Green", "White", "White", "Green"],
                     ["White", "Brown", "White", "Green","Wall","Brown"],
@@ -31,39 +97,50 @@ class GridWorld:
                     ["White","White","White","White","White","White"]]
         else:
             self.map = map
-        if size == None:
-            self.values_map = np.zeros((6,6))
-        else:
-            self.values_map = np.zeros((size, size))
+
+        # integer tile grid, rewards[tile_id[y, x]] replaces hashing the tile name on every lookup
+        self.tile_id = np.array([[TILE_ID[tile] for tile in row] for row in self.map], dtype=np.int8)
+        # rewards and R stay float64 for the scalar step/get_reward API, only the sweep tables use dtype
+        self.rewards = np.array([0 if tile == "Wall" else self.tile_reward[tile] for tile in TILE_ID])
 
         self.states = [(c, r) for r, row in enumerate(self.map) for c, tile in enumerate(row) if tile != "Wall"]
+        self.state_index = {s: i for i, s in enumerate(self.states)}
+        self.xs = np.array([x for x, y in self.states], dtype=np.int32)  # grid coordinates of each state index
+        self.ys = np.array([y for x, y in self.states], dtype=np.int32)
+        self.R = self.rewards[self.tile_id[self.ys, self.xs]]
+
+        # deterministic moves, next_state[s, a] stays on s if a would leave the grid or walk into a wall
+        moves = [(0, -1), (0, 1), (-1, 0), (1, 0)]  # UP, DOWN, LEFT, RIGHT
+        height, width = self.tile_id.shape
+        stay = np.arange(len(self.states), dtype=np.int32)
+        flat_index = np.full(height * width, -1, dtype=np.int32)  # state index of each cell, -1 for walls
+        flat_index[self.ys * width + self.xs] = stay
+        self.next_state = np.empty((len(self.states), len(ACTIONS)), dtype=np.int32)
+        for a, (dx, dy) in enumerate(moves):
+            x_, y_ = self.xs + dx, self.ys + dy
+            inside = (0 <= x_) & (x_ < width) & (0 <= y_) & (y_ < height)
+            target = flat_index[np.clip(y_, 0, height - 1) * width + np.clip(x_, 0, width - 1)]
+            self.next_state[:, a] = np.where(inside & (target >= 0), target, stay)
+
+        # sparse transition tensor: intending action a from state s, outcome k lands in next_idx[s, a, k]
+        # with probability ACTION_PROBS[k], collecting reward R_next[s, a, k]
+        self.next_idx = self.next_state[:, ACTION_OUTCOMES]
+        self.probs = ACTION_PROBS.astype(dtype)  # matches the value dtype so the sweeps never upcast
+        self.R_next = np.broadcast_to(self.R[:, None, None], self.next_idx.shape).astype(dtype)  # reward of the tile being left
 
     def step(self, pos, action):
-        x, y = copy.deepcopy(pos)
-        x_, y_ = x,y
-
-        if self.is_valid_action(x, y, action) is False:
-            return pos, self.get_reward(pos)
+        i_next, reward = self.step_idx(self.state_index[pos], action)
+        return self.states[i_next], reward
 
-        if action == ACTIONS["UP"]:
-            y_ = y-1
-        elif action == ACTIONS["DOWN"]:
-            y_ = y+1
-        elif action == ACTIONS["LEFT"]:
-            x_ = x-1
-        elif action == ACTIONS["RIGHT"]:
-            x_ = x+1
+    def step_idx(self, s_idx, action):
+        # same as step but on state indices, no position tuples are built
+        i_next = int(self.next_state[s_idx, action])
+        return i_next, float(self.R[s_idx])
 
-        reward = self.get_reward((x, y))
-        next_pos = (x_, y_)
-
-        return next_pos, reward
-    
     def get_reward(self, pos: tuple):
         x, y = pos
-        #print(pos)
-        return self.tile_reward[self.map[y][x]]
-        
+        return float(self.rewards[self.tile_id[y, x]])
+
     def is_valid_action(self, x, y, action):
 
         x_, y_ = x, y
@@ -81,94 +158,61 @@ class GridWorld:
             return False
         elif len(self.map[0]) <= x_ or x_ < 0:
             return False
-        elif self.map[y_][x_] == "Wall":
+        elif self.tile_id[y_, x_] == WALL_ID:
             return False
 
         return True
 
 
 class Agent():
-    def __init__(self, env, gamma, policy = {}, actions= ACTIONS):
+    def __init__(self, env, gamma, policy = None, actions= ACTIONS, max_iters = 2000):
         self.actions = actions
-        self.gamma = gamma
+        self.gamma = env.dtype(gamma)
         if not policy:
-            for s in env.states:
-                policy[s] = 0
+            policy = {s: 0 for s in env.states}  # a fresh dict, agents must not share a default policy
         self.policy = policy
-        self.value_history ={}
-        for s in env.states:
-            self.value_history[s]=[]
+        self.history = np.zeros((max_iters, len(env.states)), dtype=env.dtype)  # one row of state values per recorded sweep
+        self.history_len = 0
 
         self.env = env
-        self.v = self.env.values_map
+        self.v = np.zeros(env.tile_id.shape, dtype=env.dtype)  # the agent owns its values, GridWorld stays stateless
 
         
-    def get_action_probs(self, action):
-        if action == 0:
-            return [0,2,3], [0.8,0.1,0.1]
-        if action == 1:
-            return [1,2,3], [0.8,0.1,0.1]
-        if action == 2:
-            return [2,0,1], [0.8,0.1,0.1]
-        if action == 3:
-            return [3,0,1], [0.8,0.1,0.1]
-
-    def evaluate_policy(self):
+    def record_values(self, V):
+        if self.history_len == len(self.history):  # grow instead of dropping sweeps past max_iters
+            self.history = np.concatenate([self.history, np.zeros_like(self.history)])
+        self.history[self.history_len] = V
+        self.history_len += 1
+
+    def evaluate_policy(self, verbose=False):
         theta = .001
         count = 0
-        all_states = self.policy.keys()
+        env = self.env
+        V = self.v[env.ys, env.xs]
+        rows = np.arange(len(env.states))
+        policy = np.array([self.policy[s] for s in env.states], dtype=np.int8)
+        next_idx = env.next_idx[rows, policy]  # (N, 3) outcomes of the action each state follows
+        R_next = env.R_next[rows, policy]
         delta = np.inf
         while delta >= theta:
-            count+=1
-            #print(count)
-            delta = 0
-            v_tmp = copy.deepcopy(self.v)
-            for s in all_states:
-                x, y = s
-
-                actions, probs = self.get_action_probs(self.policy[s])
-                value = 0
-                for a, p in zip(actions,probs):
-                    s_, r = self.env.step(s, a)
-                    x_, y_ = s_
-                    value += p*(r + self.gamma * v_tmp[y_][x_]) #we can put r inside as p sums to 1 anyway
-
-                self.v[y][x] = value
-                #self.value_history[(x,y)].append(value) #uncomment this if we want to record value history at every
-                                                         #policy evaluation step
-                delta = max(delta, abs(v_tmp[y][x] - self.v[y][x]))
-
-            if delta <= theta:
-                for s in all_states:
-                    x, y = s
-                    self.value_history[(x, y)].append(self.v[y][x])
+            count += 1
+            if verbose and count % 100 == 0:
+                print(count)
+            V, delta = evaluate_sweep(R_next, next_idx, env.probs, V, self.gamma)
+            #self.record_values(V) #uncomment this if we want to record value history at every
+                                   #policy evaluation step
 
+        self.v[env.ys, env.xs] = V
+        self.record_values(V)
 
 
     def improve_policy(self):
-        is_stable = True
-        all_states = self.policy.keys()
-        for s in all_states:
-            old_pi = copy.deepcopy(self.policy[s])
-            argmax_action = None
-            max_a_value = -1
-
-            for action in self.actions.values():
-                a_value = 0
-                actionl, probs = self.get_action_probs(action)
-                for a, p in zip(actionl,probs):
-                    s_, r = self.env.step(s, a)
-                    x_, y_ = s_
-                    a_value += p*(self.gamma * self.v[y_][x_])
-
-                if a_value > max_a_value:
-
-                    max_a_value = a_value
-                    argmax_action = action
-                    self.policy[s] = argmax_action
-
-            if old_pi != argmax_action:
-                is_stable = False
+        env = self.env
+        V = self.v[env.ys, env.xs]
+        policy = np.array([self.policy[s] for s in env.states], dtype=np.int8)
+        policy, is_stable = improve_sweep(env.next_idx, env.probs, V, policy, self.gamma)
+        for s, a in zip(env.states, policy):
+            self.policy[s] = int(a)
 
         return is_stable
 
@@ -193,8 +237,9 @@ if __name__ == '__main__':
     print("Agent policy:")
     pprint.pprint((agent.policy))
 
-    df_dict = {str(key): value for key, value in agent.value_history.items()}
-    df = pd.DataFrame.from_dict(df_dict)
-    df.loc[0] = 0
-    df.to_csv(r"C:\Users\Admin\PycharmProjects\pythonProject\policy_iteration.csv", index=False)
+    with open(r"C:\Users\Admin\PycharmProjects\pythonProject\policy_iteration.csv", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow([str(s) for s in env.states])
+        writer.writerow([0.0] * len(env.states))  # initial values take the place of the first recorded sweep
+        writer.writerows(agent.history[1:agent.history_len].astype(str))
 
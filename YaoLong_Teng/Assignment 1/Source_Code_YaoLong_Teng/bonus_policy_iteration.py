@@ -1,15 +1,28 @@
 import random
+import csv
 import numpy as np
-import copy
-import pandas as pd
 import pprint
 
+try:
+    from numba import njit
+except ImportError:  # numba is optional, the NumPy sweeps are used without it
+    njit = None
+
+try:
+    import jax
+    import jax.numpy as jnp
+except ImportError:  # jax is optional as well, Agent(backend="jax") needs it
+    jax = None
+
 TILE_REWARD = {
     "White": -0.04,
     "Brown": -1,
     "Green": 1,
 }
 
+TILE_ID = {"White": 0, "Brown": 1, "Green": 2, "Wall": 3}
+WALL_ID = TILE_ID["Wall"]
+
 ACTIONS = {
     "UP": 0,
     "DOWN": 1,
@@ -17,11 +30,121 @@ ACTIONS = {
     "RIGHT": 3
 }
 
+# intended action first (p=0.8), then the two perpendicular slips (p=0.1 each)
+ACTION_OUTCOMES = np.array([[0, 2, 3], [1, 2, 3], [2, 0, 1], [3, 0, 1]], dtype=np.int8)
+ACTION_PROBS = np.array([0.8, 0.1, 0.1])
+
+
+def numpy_evaluate(R_next, next_idx, probs, V, gamma):
+    V_new = (probs * (R_next + gamma * V[next_idx])).sum(-1)  # we can put r inside as p sums to 1 anyway
+    return V_new, np.abs(V_new - V).max()
+
+
+def loop_evaluate(R_next, next_idx, probs, V, gamma):
+    # Gauss-Seidel: V is updated in place, which saves the V_new buffer
+    n_states, n_outcomes = next_idx.shape
+    delta = 0.0
+    for s in range(n_states):
+        value = 0.0
+        for k in range(n_outcomes):
+            value += probs[k] * (R_next[s, k] + gamma * V[next_idx[s, k]])
+        delta = max(delta, abs(value - V[s]))
+        V[s] = value
+    return V, delta
+
+
+def loop_improve(R_next, next_idx, probs, V, policy, gamma):
+    n_states, n_actions, n_outcomes = next_idx.shape
+    new_policy = policy.copy()
+    is_stable = True
+    for s in range(n_states):
+        argmax_action = 0
+        max_a_value = 0.0  # seeded by the first action, a fixed floor like -1 skips states whose values are lower
+
+        for a in range(n_actions):
+            a_value = 0.0
+            for k in range(n_outcomes):
+                a_value += probs[k] * (R_next[s, a, k] + gamma * V[next_idx[s, a, k]])
+
+            if a == 0 or a_value > max_a_value:
+                max_a_value = a_value
+                argmax_action = a
+                new_policy[s] = argmax_action
+
+        if policy[s] != argmax_action:
+            is_stable = False
+
+    return new_policy, is_stable
+
+
+def numpy_policy_step(R_next, next_idx, probs, V, policy, gamma, eval_sweeps, theta, history, row):
+    rows = np.arange(len(policy))
+    R_pi, next_pi = R_next[rows, policy], next_idx[rows, policy]  # fixed while the policy is evaluated
+    delta = 0.0  # eval_sweeps >= 1 always overwrites it
+    for i in range(eval_sweeps):
+        V, delta = numpy_evaluate(R_pi, next_pi, probs, V, gamma)
+        history[row + i] = V
+    Q = (probs * (R_next + gamma * V[next_idx])).sum(-1)
+    new_policy = Q.argmax(1).astype(policy.dtype)
+    return V, new_policy, bool((new_policy == policy).all()) and delta < theta
+
+
+def loop_policy_step(R_next, next_idx, probs, V, policy, gamma, eval_sweeps, theta, history, row):
+    # modified policy iteration: a few in-place evaluation sweeps of the current policy, then one greedy improvement.
+    # V after each sweep goes to history[row + i], the caller makes room for eval_sweeps rows
+    n_states, n_actions, n_outcomes = next_idx.shape
+    delta = 0.0  # finite seed, fastmath assumes no inf; eval_sweeps >= 1 always overwrites it
+    for i in range(eval_sweeps):
+        delta = 0.0
+        for s in range(n_states):
+            a = policy[s]
+            value = 0.0
+            for k in range(n_outcomes):
+                value += probs[k] * (R_next[s, a, k] + gamma * V[next_idx[s, a, k]])
+            delta = max(delta, abs(value - V[s]))
+            V[s] = value
+        history[row + i] = V
+    new_policy, is_stable = improve_sweep(R_next, next_idx, probs, V, policy, gamma)
+    return V, new_policy, is_stable and delta < theta
+
+
+def jax_policy_step(R_next, next_idx, probs, V, policy, gamma, eval_sweeps, theta):
+    # numpy_policy_step compiled as one XLA program, lax.scan stacks V after each evaluation sweep as history
+    rows = jnp.arange(policy.shape[0])
+    R_pi, next_pi = R_next[rows, policy], next_idx[rows, policy]
+
+    def evaluate(V, _):
+        V_new = (probs * (R_pi + gamma * V[next_pi])).sum(-1)
+        return V_new, (V_new, jnp.abs(V_new - V).max())
+
+    V, (history, deltas) = jax.lax.scan(evaluate, V, None, length=eval_sweeps)
+    Q = (probs * (R_next + gamma * V[next_idx])).sum(-1)
+    new_policy = Q.argmax(1).astype(policy.dtype)
+    return V, new_policy, (new_policy == policy).all() & (deltas[-1] < theta), history
+
+
+# Numba runs policy evaluation (also inside policy_step) Gauss-Seidel, the NumPy fallback Jacobi since an
+# in-place update cannot be vectorized. Both converge, but the final values and recorded history differ
+# slightly between the two, so results depend on whether Numba is installed
+if njit is not None:
+    evaluate_sweep = njit(cache=True, fastmath=True)(loop_evaluate)
+    improve_sweep = njit(cache=True, fastmath=True)(loop_improve)
+    policy_step = njit(cache=True, fastmath=True)(loop_policy_step)
+else:
+    evaluate_sweep = numpy_evaluate
+    improve_sweep = loop_improve
+    policy_step = numpy_policy_step
+
+# opt-in through Agent(backend="jax"), the first call per map shape spends a second or more compiling
+policy_step_jax = jax.jit(jax_policy_step, static_argnames="eval_sweeps") if jax is not None else None
+
+
 
 class GridWorld:
 
-    def __init__(self, tile_reward=TILE_REWARD, map=None, size=None):
+    def __init__(self, tile_reward=TILE_REWARD, map=None, dtype=np.float32):
         self.tile_reward = tile_reward
+        self.dtype = dtype  # float32 is plenty for these grids, pass np.float64 for full precision
         if map == None:
             self.map = [["Green", "Wall", "Green", "White", "White", "Green"],
                         ["White", "Brown", "White", "Green", "Wall", "Brown"],
@@ -31,37 +154,49 @@ class GridWorld:
                         ["White", "White", "White", "White", "White", "White"]]
         else:
             self.map = map
-        if size == None:
-            self.values_map = np.zeros((6, 6))
-        else:
-            self.values_map = np.zeros((size, size))
+
+        # integer tile grid, rewards[tile_id[y, x]] replaces hashing the tile name on every lookup
+        self.tile_id = np.array([[TILE_ID[tile] for tile in row] for row in self.map], dtype=np.int8)
+        # rewards and R stay float64 for the scalar step/get_reward API, only the sweep tables use dtype
+        self.rewards = np.array([0 if tile == "Wall" else self.tile_reward[tile] for tile in TILE_ID])
 
         self.states = [(c, r) for r, row in enumerate(self.map) for c, tile in enumerate(row) if tile != "Wall"]
+        self.state_index = {s: i for i, s in enumerate(self.states)}
+        self.xs = np.array([x for x, y in self.states], dtype=np.int32)  # grid coordinates of each state index
+        self.ys = np.array([y for x, y in self.states], dtype=np.int32)
+        self.R = self.rewards[self.tile_id[self.ys, self.xs]]
+
+        # deterministic moves, next_state[s, a] stays on s if a would leave the grid or walk into a wall
+        moves = [(0, -1), (0, 1), (-1, 0), (1, 0)]  # UP, DOWN, LEFT, RIGHT
+        height, width = self.tile_id.shape
+        stay = np.arange(len(self.states), dtype=np.int32)
+        flat_index = np.full(height * width, -1, dtype=np.int32)  # state index of each cell, -1 for walls
+        flat_index[self.ys * width + self.xs] = stay
+        self.next_state = np.empty((len(self.states), len(ACTIONS)), dtype=np.int32)
+        for a, (dx, dy) in enumerate(moves):
+            x_, y_ = self.xs + dx, self.ys + dy
+            inside = (0 <= x_) & (x_ < width) & (0 <= y_) & (y_ < height)
+            target = flat_index[np.clip(y_, 0, height - 1) * width + np.clip(x_, 0, width - 1)]
+            self.next_state[:, a] = np.where(inside & (target >= 0), target, stay)
+
+        # sparse transition tensor: intending action a from state s, outcome k lands in next_idx[s, a, k]
+        # with probability ACTION_PROBS[k], collecting reward R_next[s, a, k]
+        self.next_idx = self.next_state[:, ACTION_OUTCOMES]
+        self.probs = ACTION_PROBS.astype(dtype)  # matches the value dtype so the sweeps never upcast
+        self.R_next = self.R[self.next_idx].astype(dtype)
 
     def step(self, pos, action):
-        x_, y_ = copy.deepcopy(pos)
-
-        if self.is_valid_action(x_, y_, action) is False:
-            return pos, self.get_reward(pos)
-
-        if action == ACTIONS["UP"]:
-            y_ += -1
-        elif action == ACTIONS["DOWN"]:
-            y_ += 1
-        elif action == ACTIONS["LEFT"]:
-            x_ += -1
-        elif action == ACTIONS["RIGHT"]:
-            x_ += 1
+        i_next, reward = self.step_idx(self.state_index[pos], action)
+        return self.states[i_next], reward
 
-        reward = self.get_reward((x_, y_))
-        next_pos = (x_, y_)
-
-        return next_pos, reward
+    def step_idx(self, s_idx, action):
+        # same as step but on state indices, no position tuples are built
+        i_next = int(self.next_state[s_idx, action])
+        return i_next, float(self.R[i_next])
 
     def get_reward(self, pos: tuple):
         x, y = pos
-        # print(pos)
-        return self.tile_reward[self.map[y][x]]
+        return float(self.rewards[self.tile_id[y, x]])
 
     def is_valid_action(self, x, y, action):
 
@@ -80,90 +215,95 @@ class GridWorld:
             return False
         elif len(self.map[0]) <= x_ or x_ < 0:
             return False
-        elif self.map[y_][x_] == "Wall":
+        elif self.tile_id[y_, x_] == WALL_ID:
             return False
 
         return True
 
 
 class Agent():
-    def __init__(self, env, gamma, policy={}, actions=ACTIONS):
+    def __init__(self, env, gamma, policy=None, actions=ACTIONS, max_iters=2000, backend=None):
         self.actions = actions
-        self.gamma = gamma
+        self.gamma = env.dtype(gamma)
         if not policy:
-            for s in env.states:
-                policy[s] = 0
+            policy = {s: 0 for s in env.states}  # a fresh dict, agents must not share a default policy
         self.policy = policy
-        self.value_history = {}
-        for s in env.states:
-            self.value_history[s] = []
+        self.history = np.zeros((max_iters, len(env.states)), dtype=env.dtype)  # one row of state values per recorded sweep
+        self.history_len = 0
 
         self.env = env
-        self.v = self.env.values_map
-
-    def get_action_probs(self, action):
-        if action == 0:
-            return [0, 2, 3], [0.8, 0.1, 0.1]
-        if action == 1:
-            return [1, 2, 3], [0.8, 0.1, 0.1]
-        if action == 2:
-            return [2, 0, 1], [0.8, 0.1, 0.1]
-        if action == 3:
-            return [3, 0, 1], [0.8, 0.1, 0.1]
-
-    def evaluate_policy(self):
+        self.v = np.zeros(env.tile_id.shape, dtype=env.dtype)  # the agent owns its values, GridWorld stays stateless
+        # None picks the Numba kernels, or NumPy without Numba. "jax" only changes policy_iteration_step,
+        # evaluate_policy and improve_policy have no JAX version
+        self.backend = backend
+        if backend == "jax":
+            if jax is None:
+                raise ImportError("backend='jax' requires jax to be installed")
+            jax.config.update("jax_enable_x64", True)  # otherwise dtype=np.float64 is silently cast to float32
+            self.tables = tuple(jnp.asarray(a) for a in (env.R_next, env.next_idx, env.probs))  # copied to the device once
+
+    def reserve_history(self, n):
+        while self.history_len + n > len(self.history):  # grow instead of dropping sweeps past max_iters
+            self.history = np.concatenate([self.history, np.zeros_like(self.history)])
+
+    def record_values(self, V):
+        self.reserve_history(1)
+        self.history[self.history_len] = V
+        self.history_len += 1
+
+    def evaluate_policy(self, verbose=False):
         theta = .1
         count = 0
-        all_states = self.policy.keys()
+        env = self.env
+        V = self.v[env.ys, env.xs]
+        rows = np.arange(len(env.states))
+        policy = np.array([self.policy[s] for s in env.states], dtype=np.int8)
+        next_idx = env.next_idx[rows, policy]  # (N, 3) outcomes of the action each state follows
+        R_next = env.R_next[rows, policy]
         delta = np.inf
         while delta >= theta:
             count += 1
-            # print(count)
-            delta = 0
-            v_tmp = copy.deepcopy(self.v)
-            for s in all_states:
-                x, y = s
-
-                actions, probs = self.get_action_probs(self.policy[s])
-                value = 0
-                for a, p in zip(actions, probs):
-                    s_, r = self.env.step(s, a)
-                    x_, y_ = s_
-                    value += p * (r + self.gamma * v_tmp[y_][x_])
-
-                self.v[y][x] = value
-                self.value_history[(x, y)].append(value)  # uncomment this if we want to record value history at every
-                # policy evaluation step
-                delta = max(delta, abs(v_tmp[y][x] - self.v[y][x]))
-
-            if delta <= theta:
-                for s in all_states:
-                    x, y = s
-                    # self.value_history[(x, y)].append(self.v[y][x])
+            if verbose and count % 100 == 0:
+                print(count)
+            V, delta = evaluate_sweep(R_next, next_idx, env.probs, V, self.gamma)
+            self.record_values(V)  # uncomment this if we want to record value history at every
+            # policy evaluation step
+
+        self.v[env.ys, env.xs] = V
+        # self.record_values(V)
+
 
     def improve_policy(self):
-        is_stable = True
-        all_states = self.policy.keys()
-        for s in all_states:
-            old_pi = copy.deepcopy(self.policy[s])
-            argmax_action = None
-            max_a_value = -1
-
-            for action in self.actions.values():
-                a_value = 0
-                actionl, probs = self.get_action_probs(action)
-                for a, p in zip(actionl, probs):
-                    s_, r = self.env.step(s, a)
-                    x_, y_ = s_
-                    a_value += p * (r + self.gamma * self.v[y_][x_])
-
-                if a_value > max_a_value:
-                    max_a_value = a_value
-                    argmax_action = action
-                    self.policy[s] = argmax_action
-
-            if old_pi != argmax_action:
-                is_stable = False
+        env = self.env
+        V = self.v[env.ys, env.xs]
+        policy = np.array([self.policy[s] for s in env.states], dtype=np.int8)
+        policy, is_stable = improve_sweep(env.R_next, env.next_idx, env.probs, V, policy, self.gamma)
+        for s, a in zip(env.states, policy):
+            self.policy[s] = int(a)
+
+        return is_stable
+
+    def policy_iteration_step(self, eval_sweeps=5):
+        # stable once the greedy policy stops changing and the last evaluation sweep moved V by less than theta
+        if eval_sweeps < 1:
+            raise ValueError("eval_sweeps must be at least 1")
+        theta = .1
+        env = self.env
+        V = self.v[env.ys, env.xs]
+        policy = np.array([self.policy[s] for s in env.states], dtype=np.int8)
+        self.reserve_history(eval_sweeps)  # every evaluation sweep gets a history row
+        if self.backend == "jax":
+            V, policy, is_stable, history = policy_step_jax(*self.tables, V, policy, self.gamma, eval_sweeps, theta)
+            self.history[self.history_len:self.history_len + eval_sweeps] = np.asarray(history)
+            V, policy, is_stable = np.asarray(V), np.asarray(policy), bool(is_stable)
+        else:
+            V, policy, is_stable = policy_step(env.R_next, env.next_idx, env.probs, V, policy, self.gamma, eval_sweeps,
+                                               theta, self.history, self.history_len)
+        self.history_len += eval_sweeps
+
+        self.v[env.ys, env.xs] = V
+        for s, a in zip(env.states, policy):
+            self.policy[s] = int(a)
 
         return is_stable
 
@@ -181,7 +321,7 @@ if __name__ == '__main__':
         return map_list
 
     bonus = generate_map(3)
-    env = GridWorld(map=bonus, size=3)
+    env = GridWorld(map=bonus)
     gamma = 0.99
     is_stable = False
     count = 0
@@ -189,8 +329,7 @@ if __name__ == '__main__':
     agent = Agent(env, gamma)
     print("Iterations:")
     while is_stable == False:
-        agent.evaluate_policy()
-        is_stable = agent.improve_policy()
+        is_stable = agent.policy_iteration_step()
         count += 1
         print(count)
 
@@ -200,7 +339,8 @@ if __name__ == '__main__':
     #print("Agent policy:")
     #pprint.pprint((agent.policy))
 
-    df_dict = {str(key): value for key, value in agent.value_history.items()}
-    df = pd.DataFrame.from_dict(df_dict)
-    df.loc[0] = 0
-    df.to_csv(r"C:\Users\Admin\PycharmProjects\pythonProject\bonus_policy_iteration.csv", index=False)
\ No newline at end of file
+    with open(r"C:\Users\Admin\PycharmProjects\pythonProject\bonus_policy_iteration.csv", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow([str(s) for s in env.states])
+        writer.writerow([0.0] * len(env.states))  # initial values take the place of the first recorded sweep
+        writer.writerows(agent.history[1:agent.history_len].astype(str))
\ No newline at end of file
@@ -1,7 +1,17 @@
+import csv
 import numpy as np
-import copy
 import pprint
-import pandas as pd
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional, the NumPy sweeps are used without it
+    njit = None
+
+try:
+    import jax
+    import jax.numpy as jnp
+except ImportError:  # jax is optional as well, Agent(backend="jax") needs it
+    jax = None
 
 TILE_REWARD = {
     "White": -0.04,
@@ -9,6 +19,9 @@ TILE_REWARD = {
     "Green": 1,
 }
 
+TILE_ID = {"White": 0, "Brown": 1, "Green": 2, "Wall": 3}
+WALL_ID = TILE_ID["Wall"]
+
 ACTIONS = {
     "UP": 0,
     "DOWN": 1,
@@ -16,11 +29,81 @@ ACTIONS = {
     "RIGHT": 3
 }
 
+# intended action first (p=0.8), then the two perpendicular slips (p=0.1 each)
+ACTION_OUTCOMES = np.array([[0, 2, 3], [1, 2, 3], [2, 0, 1], [3, 0, 1]], dtype=np.int8)
+ACTION_PROBS = np.array([0.8, 0.1, 0.1])
+
+
+def numpy_sweep(R_next, next_idx, probs, V, gamma):
+    Q = (probs * (R_next + gamma * V[next_idx])).sum(-1)  # we put r inside as p sums to 1 anyway
+    policy = Q.argmax(1)
+    V_new = np.take_along_axis(Q, policy[:, None], 1)[:, 0]  # gather instead of a second max pass
+    return V_new, policy, np.abs(V_new - V).max()
+
+
+def jax_sweep(R_next, next_idx, probs, V, gamma):
+    # same Jacobi sweep as numpy_sweep, traced once per map shape and compiled by XLA
+    Q = (probs * (R_next + gamma * V[next_idx])).sum(-1)
+    policy = Q.argmax(1)
+    V_new = jnp.take_along_axis(Q, policy[:, None], 1)[:, 0]
+    return V_new, policy, jnp.abs(V_new - V).max()
+
+
+def jax_value_iteration(R_next, next_idx, probs, V, gamma, theta, max_sweeps):
+    # the whole convergence loop runs on the device, values of every sweep go to a preallocated history block.
+    # Stops after max_sweeps so the block stays bounded, the caller resumes from the returned V if not converged
+    def not_converged(carry):
+        V, policy, delta, count, history = carry
+        return (delta >= theta) & (count < max_sweeps)
+
+    def sweep(carry):
+        V, policy, delta, count, history = carry
+        V, policy, delta = jax_sweep(R_next, next_idx, probs, V, gamma)
+        return V, policy.astype(jnp.int32), delta, count + 1, history.at[count].set(V)
+
+    history = jnp.zeros((max_sweeps,) + V.shape, V.dtype)
+    carry = (V, jnp.zeros(V.shape, jnp.int32), jnp.asarray(theta, V.dtype), jnp.asarray(0), history)
+    return jax.lax.while_loop(not_converged, sweep, carry)
+
+
+def loop_sweep(R_next, next_idx, probs, V, gamma):
+    # Gauss-Seidel: V is updated in place, which saves the V_new buffer
+    n_states, n_actions, n_outcomes = next_idx.shape
+    policy = np.empty(n_states, dtype=np.int8)
+    delta = 0.0
+    for s in range(n_states):
+        best_q = 0.0
+        best_a = 0
+        for a in range(n_actions):
+            q = 0.0
+            for k in range(n_outcomes):
+                q += probs[k] * (R_next[s, a, k] + gamma * V[next_idx[s, a, k]])
+            if a == 0 or q > best_q:  # no -inf sentinel, fastmath assumes finite values
+                best_q = q
+                best_a = a
+        delta = max(delta, abs(best_q - V[s]))
+        V[s] = best_q
+        policy[s] = best_a
+    return V, policy, delta
+
+
+# Numba runs the sweep Gauss-Seidel, the NumPy fallback Jacobi since an in-place update cannot be
+# vectorized. Both converge, but the final values and recorded history differ slightly between the
+# two, so results depend on whether Numba is installed
+if njit is not None:
+    bellman_sweep = njit(cache=True, fastmath=True)(loop_sweep)
+else:
+    bellman_sweep = numpy_sweep
+
+# opt-in through Agent(backend="jax"), the first call per map shape spends a second or more compiling
+jax_value_loop = jax.jit(jax_value_iteration, static_argnames="max_sweeps") if jax is not None else None
+
 
 class GridWorld:
 
-    def __init__(self, tile_reward= TILE_REWARD, map = None, size = None):
+    def __init__(self, tile_reward= TILE_REWARD, map = None, dtype=np.float32):
         self.tile_reward = tile_reward
+        self.dtype = dtype  # float32 is plenty for these grids, pass np.float64 for full precision
         if map == None:
             self.map = [["Green", "Wall", "Green", "White", "White", "Green"],
                     ["White", "Brown", "White", "Green","Wall","Brown"],
@@ -30,37 +113,49 @@ class GridWorld:
                     ["White","White","White","White","White","White"]]
         else:
             self.map = map
-        if size == None:
-            self.values_map = np.zeros((6,6))
-        else:
-            self.values_map = np.zeros((size, size))
+
+        # integer tile grid, rewards[tile_id[y, x]] replaces hashing the tile name on every lookup
+        self.tile_id = np.array([[TILE_ID[tile] for tile in row] for row in self.map], dtype=np.int8)
+        # rewards and R stay float64 for the scalar step/get_reward API, only the sweep tables use dtype
+        self.rewards = np.array([0 if tile == "Wall" else self.tile_reward[tile] for tile in TILE_ID])
 
         self.states = [(c, r) for r, row in enumerate(self.map) for c, tile in enumerate(row) if tile != "Wall"]
+        self.state_index = {s: i for i, s in enumerate(self.states)}
+        self.xs = np.array([x for x, y in self.states], dtype=np.int32)  # grid coordinates of each state index
+        self.ys = np.array([y for x, y in self.states], dtype=np.int32)
+        self.R = self.rewards[self.tile_id[self.ys, self.xs]]
+
+        # deterministic moves, next_state[s, a] stays on s if a would leave the grid or walk into a wall
+        moves = [(0, -1), (0, 1), (-1, 0), (1, 0)]  # UP, DOWN, LEFT, RIGHT
+        height, width = self.tile_id.shape
+        stay = np.arange(len(self.states), dtype=np.int32)
+        flat_index = np.full(height * width, -1, dtype=np.int32)  # state index of each cell, -1 for walls
+        flat_index[self.ys * width + self.xs] = stay
+        self.next_state = np.empty((len(self.states), len(ACTIONS)), dtype=np.int32)
+        for a, (dx, dy) in enumerate(moves):
+            x_, y_ = self.xs + dx, self.ys + dy
+            inside = (0 <= x_) & (x_ < width) & (0 <= y_) & (y_ < height)
+            target = flat_index[np.clip(y_, 0, height - 1) * width + np.clip(x_, 0, width - 1)]
+            self.next_state[:, a] = np.where(inside & (target >= 0), target, stay)
+
+        # sparse transition tensor: intending action a from state s, outcome k lands in next_idx[s, a, k]
+        # with probability ACTION_PROBS[k], collecting reward R_next[s, a, k]
+        self.next_idx = self.next_state[:, ACTION_OUTCOMES]
+        self.probs = ACTION_PROBS.astype(dtype)  # matches the value dtype so the sweeps never upcast
+        self.R_next = self.R[self.next_idx].astype(dtype)
 
     def step(self, pos, action):
-        x_, y_ = copy.deepcopy(pos)
-
-        if self.is_valid_action(x_, y_, action) is False:
-            return pos, self.get_reward(pos)
-
-        if action == ACTIONS["UP"]:
-            y_ += -1
-        elif action == ACTIONS["DOWN"]:
-            y_ += 1
-        elif action == ACTIONS["LEFT"]:
-            x_ += -1
-        elif action == ACTIONS["RIGHT"]:
-            x_ += 1
-
-        reward = self.get_reward((x_, y_))
-        next_pos = (x_, y_)
+        i_next, reward = self.step_idx(self.state_index[pos], action)
+        return self.states[i_next], reward
 
-        return next_pos, reward
+    def step_idx(self, s_idx, action):
+        # same as step but on state indices, no position tuples are built
+        i_next = int(self.next_state[s_idx, action])
+        return i_next, float(self.R[i_next])
 
     def get_reward(self, pos: tuple):
         x, y = pos
-        # print(pos)
-        return self.tile_reward[self.map[y][x]]
+        return float(self.rewards[self.tile_id[y, x]])
 
     def is_valid_action(self, x, y, action):
 
@@ -79,75 +174,73 @@ class GridWorld:
             return False
         elif len(self.map[0]) <= x_ or x_ < 0:
             return False
-        elif self.map[y_][x_] == "Wall":
+        elif self.tile_id[y_, x_] == WALL_ID:
             return False
 
         return True
 
 
 class Agent():
-    def __init__(self, env, gamma, policy={}, actions=ACTIONS):
+    def __init__(self, env, gamma, policy=None, actions=ACTIONS, max_iters=2000, backend=None):
         self.actions = actions
-        self.gamma = gamma
+        self.gamma = env.dtype(gamma)
         if not policy:
-            for s in env.states:
-                policy[s] = None
+            policy = {s: None for s in env.states}  # a fresh dict, agents must not share a default policy
         self.policy = policy
         self.env = env
-        self.value_history ={}
-        for s in env.states:
-            self.value_history[s]=[]
-        self.v = self.env.values_map
-
-    def get_action_probs(self, action):
-        if action == 0:
-            return [0, 2, 3], [0.8, 0.1, 0.1]
-        if action == 1:
-            return [1, 2, 3], [0.8, 0.1, 0.1]
-        if action == 2:
-            return [2, 0, 1], [0.8, 0.1, 0.1]
-        if action == 3:
-            return [3, 0, 1], [0.8, 0.1, 0.1]
-
-    def value_iteration(self):
+        self.history = np.zeros((max_iters, len(env.states)), dtype=env.dtype)  # one row of state values per recorded sweep
+        self.history_len = 0
+        self.v = np.zeros(env.tile_id.shape, dtype=env.dtype)  # the agent owns its values, GridWorld stays stateless
+        self.max_iters = max_iters
+        self.backend = backend  # None picks the Numba kernels, or NumPy without Numba
+        if backend == "jax":
+            if jax is None:
+                raise ImportError("backend='jax' requires jax to be installed")
+            jax.config.update("jax_enable_x64", True)  # otherwise dtype=np.float64 is silently cast to float32
+            self.tables = tuple(jnp.asarray(a) for a in (env.R_next, env.next_idx, env.probs))  # copied to the device once
+
+    def reserve_history(self, n):
+        while self.history_len + n > len(self.history):  # grow instead of dropping sweeps past max_iters
+            self.history = np.concatenate([self.history, np.zeros_like(self.history)])
+
+    def record_values(self, V):
+        self.reserve_history(1)
+        self.history[self.history_len] = V
+        self.history_len += 1
+
+    def value_iteration(self, verbose=False):
         theta = 0.00101
         count = 0
-        all_states = self.policy.keys()
-        flag = True
-
-        while flag:
-            count += 1
-            #if count == 36:  #specifies when to break iteration if we do not use theta as nreak condition
-                #break
-            print(count)
-            delta = 0
-            v_tmp = copy.deepcopy(self.v)
-            for s in all_states:
-                x, y = s
-                max_a_value = -1
-
-                for action in self.actions.values():
-                    a_value = 0
-                    actionl, probs = self.get_action_probs(action)
-                    for a, p in zip(actionl, probs):
-                        s_, r = self.env.step(s, a)
-                        x_, y_ = s_                                     #we put r inside as p sums to 1 anyway
-                        a_value += p * (r + self.gamma * v_tmp[y_][x_]) #after iteration ends
-
-                    if a_value > max_a_value:
-
-                        max_a_value = a_value
-                        argmax_action = action
-                        self.policy[s] = argmax_action
-                        self.v[y][x] = max_a_value
-                        delta1= abs(v_tmp[y][x] - self.v[y][x])
+        env = self.env
+        V = self.v[env.ys, env.xs]
+
+        if self.backend == "jax":
+            delta = theta
+            while delta >= theta:  # one host round trip per block of max_iters sweeps
+                V, policy, delta, n, history = jax_value_loop(*self.tables, V, self.gamma, theta, self.max_iters)
+                n = int(n)
+                self.reserve_history(n)
+                self.history[self.history_len:self.history_len + n] = np.asarray(history[:n])
+                self.history_len += n
+                if verbose:
+                    print(self.history_len)
+            V, policy = np.asarray(V), np.asarray(policy)
+        else:
+            while True:
+                count += 1
+                #if count == 36:  #specifies when to break iteration if we do not use theta as break condition
+                    #break
+                if verbose and count % 100 == 0:
+                    print(count)
+                V, policy, delta = bellman_sweep(env.R_next, env.next_idx, env.probs, V, self.gamma)
+                self.record_values(V)
 
-                self.value_history[(x, y)].append(self.v[y][x])
+                if delta < theta:  # delta covers the whole sweep
+                    break
 
-                delta = max(delta, delta1)
-                if delta < theta:
-                    flag = False
-                    #print(delta, x,y)
+        for s, a in zip(env.states, policy):
+            self.policy[s] = int(a)
+        self.v[env.ys, env.xs] = V
 
 
 
@@ -164,14 +257,14 @@ if __name__ == '__main__':
         return map_list
 
     bonus = generate_map(3)
-    env = GridWorld(map=bonus, size=3)
+    env = GridWorld(map=bonus)
     gamma = 0.99
     is_stable = False
     count = 0
 
     agent = Agent(env, gamma)
     agent.value_iteration()
-        # print(count)
+    print("Iterations:", agent.history_len)
 
 
     print("Values for each state:")
@@ -180,7 +273,8 @@ if __name__ == '__main__':
     print("Agent policy:")
     pprint.pprint((agent.policy))
 
-    df_dict = {str(key): value for key, value in agent.value_history.items()}
-    df = pd.DataFrame.from_dict(df_dict)
-    df.loc[0] = 0
-    df.to_csv(r"C:\Users\Admin\PycharmProjects\pythonProject\bonus_value_iteration.csv", index=False)
\ No newline at end of file
+    with open(r"C:\Users\Admin\PycharmProjects\pythonProject\bonus_value_iteration.csv", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow([str(s) for s in env.states])
+        writer.writerow([0.0] * len(env.states))  # initial values take the place of the first recorded sweep
+        writer.writerows(agent.history[1:agent.history_len].astype(str))
\ No newline at end of file